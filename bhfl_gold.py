@@ -1,22 +1,35 @@
-import os
 import io
-import tempfile
+import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs as pafs
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.platypus import (
-    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak, Frame, PageTemplate
+    SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer, Image, PageBreak, Frame, PageTemplate
 )
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.pdfencrypt import StandardEncryption
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from PyPDF2 import PdfReader, PdfWriter
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
+from email.generator import BytesGenerator
 
 # ---------------- CONFIG ----------------
 S3_BUCKET = "bhfl-bank-transformed"
@@ -29,14 +42,62 @@ UPLOAD_TO_S3 = True
 SEND_SMS_PASSWORD = True                   # sends password via SNS to phone (recommended)
 LOGO_S3_KEY = None                         # e.g., "assets/logo.png" or None to skip logo
 FONT_TTF_PATH = None                       # optional custom font path (ttf). None uses defaults.
+MAX_WORKERS = 16                           # customers processed concurrently
+SES_MAX_SENDERS = 20                       # SES sender threads; capped by MaxSendRate, which needs
+                                           # ses:GetSendQuota (without it all 20 threads are used)
 # ----------------------------------------
 
-s3 = boto3.client("s3", region_name=AWS_REGION)
-ses = boto3.client("ses", region_name=AWS_REGION) if SEND_VIA_SES else None
+# boto3 clients are thread-safe; size the pool so workers don't queue on connections
+# and keep connections alive so SES/S3 calls reuse them
+boto_cfg = Config(region_name=AWS_REGION, max_pool_connections=64,
+                  retries={"max_attempts": 10, "mode": "adaptive"}, tcp_keepalive=True)
+s3 = boto3.client("s3", config=boto_cfg)
+ses = boto3.client("ses", config=boto_cfg) if SEND_VIA_SES else None
+arrow_s3 = pafs.S3FileSystem(region=AWS_REGION)
+# statements above 8 MB go up as parallel multipart parts; smaller ones are a single PUT
+UPLOAD_MULTIPART_THRESHOLD = 8 << 20
+UPLOAD_TRANSFER_CFG = TransferConfig(multipart_threshold=UPLOAD_MULTIPART_THRESHOLD, max_concurrency=8, use_threads=True)
+
+_print_lock = threading.Lock()
+
+def log(*args):
+    """print() guarded by a lock so lines from worker threads don't interleave"""
+    with _print_lock:
+        print(*args)
+
+# register the custom font once at import; every PDF then shares its parsed metrics
+if FONT_TTF_PATH:
+    pdfmetrics.registerFont(TTFont("CustomFont", FONT_TTF_PATH))
+BODY_FONT = "CustomFont" if FONT_TTF_PATH else "Helvetica"
 
 styles = getSampleStyleSheet()
-styles.add(ParagraphStyle(name='Small', fontSize=9, leading=11))
-styles.add(ParagraphStyle(name='Tiny', fontSize=8, leading=10))
+styles.add(ParagraphStyle(name='Small', fontName=BODY_FONT, fontSize=9, leading=11))
+styles.add(ParagraphStyle(name='Tiny', fontName=BODY_FONT, fontSize=8, leading=10))
+
+# built once and shared by every statement
+SUMMARY_TABLE_STYLE = TableStyle([('FONTNAME', (0,0), (-1,-1), BODY_FONT),
+                                  ('FONTSIZE', (0,0), (-1,-1), 9),
+                                  ('BOTTOMPADDING', (0,0), (-1,-1), 6)])
+TX_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f1f1f1')),
+    ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+    ('FONTNAME', (0,0), (-1,-1), BODY_FONT),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('ALIGN', (2,1), (3,-1), 'RIGHT'),
+    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+])
+META_TEMPLATE = (
+    "<b>Account Holder:</b> {name}<br/>"
+    "<b>Account No:</b> {acct}<br/>"
+    "<b>Statement Period:</b> {period}<br/>"
+)
+EMAIL_SUBJECT_TEMPLATE = "Your Monthly Bank Statement - {period}"
+EMAIL_BODY_TEMPLATE = (
+    "Dear {name},\n\n"
+    "Please find attached your password-protected monthly bank statement.\n"
+    "For security, the password has been sent separately.\n\n"
+    "Regards,\nYour Bank"
+)
 
 PAGE_SIZE = LETTER
 PAGE_WIDTH, PAGE_HEIGHT = PAGE_SIZE
@@ -53,68 +114,134 @@ COLS = {
     "amt": "amount",
     "bal": "availablebalance",
 }
+META_COLS = [COLS["name"], COLS["email"], COLS["phone"], COLS["acct"]]
+TXN_COLS = [COLS["date"], COLS["desc"], COLS["amt"], COLS["bal"]]
 
 
 # -------- helpers --------
-def list_customer_folders(month):
-    """Return list of cust_id values under BASE_PATH/month={month}/"""
+CUST_KEY_RE = re.compile(r"cust_id=([^/]+)/.*\.parquet$", re.IGNORECASE)
+
+@lru_cache(maxsize=8)
+def _customer_key_map(month):
+    """Return ((cust_id, (parquet keys...)), ...) under BASE_PATH/month={month}/ from one flat listing.
+    Cached per month (immutable result) so re-running a month in-process doesn't relist S3."""
     prefix = f"{BASE_PATH}/month={month}/"
     paginator = s3.get_paginator("list_objects_v2")
-    customer_ids = []
-    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix, Delimiter="/"):
-        for cp in page.get("CommonPrefixes", []):
-            p = cp["Prefix"]
-            if "cust_id=" in p:
-                cust = p.split("cust_id=")[1].rstrip("/")
-                customer_ids.append(cust)
-    return customer_ids
-
-def list_parquet_keys_for_customer(month, cust_id):
-    prefix = f"{BASE_PATH}/month={month}/cust_id={cust_id}/"
-    keys = []
-    paginator = s3.get_paginator("list_objects_v2")
+    customer_keys = {}
     for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
         for obj in page.get("Contents", []):
-            if obj["Key"].lower().endswith(".parquet"):
-                keys.append(obj["Key"])
-    return keys
-
-def load_parquet_from_s3(key):
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        s3.download_file(S3_BUCKET, key, tmp.name)
-        df = pd.read_parquet(tmp.name)
-    os.unlink(tmp.name)
-    return df
+            m = CUST_KEY_RE.search(obj["Key"])
+            if m:
+                customer_keys.setdefault(m.group(1), []).append(obj["Key"])
+    return tuple((cust_id, tuple(keys)) for cust_id, keys in customer_keys.items())
+
+def _projected_columns(schema_names, wanted):
+    """Columns of wanted present in the file schema, matched case-insensitively"""
+    wanted = set(wanted)
+    return [n for n in schema_names if n.lower() in wanted]
+
+def load_customer_meta(keys):
+    """Return {column: value} for name/email/phone/acct from the first row of the
+    customer's parquet files (skipping empty files/row groups), or None if there is none"""
+    for key in keys:
+        # ranged reads: only the footer and these column chunks of one row group are fetched
+        with arrow_s3.open_input_file(f"{S3_BUCKET}/{key}") as f:
+            pf = pq.ParquetFile(f)
+            columns = _projected_columns(pf.schema_arrow.names, META_COLS)
+            for i in range(pf.metadata.num_row_groups):
+                if pf.metadata.row_group(i).num_rows:
+                    row = pf.read_row_group(i, columns=columns).slice(0, 1).to_pylist()[0]
+                    return {k.lower(): v for k, v in row.items()}
+    return None
+
+def _try_load_customer_meta(cust_id, keys):
+    try:
+        meta = load_customer_meta(keys)
+    except Exception as e:
+        log(f"Failed to read meta for {cust_id}, skipping: {e}")
+        return None
+    if meta is None:
+        log(f"No rows for {cust_id}, skipping.")
+    return meta
+
+def load_month_meta(customer_keys):
+    """One row of META_COLS per customer, indexed by cust_id. Customers whose meta can't be
+    read are left out, rather than processed with blank details and a guessed password."""
+    cust_ids = list(customer_keys)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        rows = list(ex.map(_try_load_customer_meta, cust_ids, customer_keys.values()))
+    loaded = [(c, r) for c, r in zip(cust_ids, rows) if r is not None]
+    # object dtype keeps ints/strings as read, so str() of a phone matches the raw value
+    meta_df = pd.DataFrame([r for _, r in loaded], index=pd.Index([c for c, _ in loaded], name="cust_id"),
+                           dtype=object)
+    # nulls print as "" (not "nan") on the statement; a null phone still falls back to cust_id
+    return meta_df.reindex(columns=META_COLS).fillna("")
+
+def _try_read_schema(path):
+    try:
+        return pq.read_schema(path, filesystem=arrow_s3)
+    except Exception as e:
+        log(f"Failed to load {path}: {e}")
+        return None
 
-def assemble_customer_df(month, cust_id):
-    keys = list_parquet_keys_for_customer(month, cust_id)
+def _try_scan_fragment(fragment, schema, columns):
+    try:
+        return fragment.to_table(schema=schema, columns=columns)
+    except Exception as e:
+        log(f"Failed to load {fragment.path}: {e}")
+        return None
+
+def assemble_customer_df(cust_id, keys):
     if not keys:
         return pd.DataFrame()
-    dfs = []
-    for k in keys:
+    paths = [f"{S3_BUCKET}/{k}" for k in keys]
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        # footers only; a file that can't be opened is logged and left out
+        schemas = dict(zip(paths, ex.map(_try_read_schema, paths)))
+        paths = [p for p in paths if schemas[p] is not None]
+        if not paths:
+            return pd.DataFrame()
+        # unify over every file instead of inferring from the first: a column missing from
+        # some files comes back null there, and int/float mixes are promoted to float
         try:
-            dfs.append(load_parquet_from_s3(k))
+            schema = pa.unify_schemas([schemas[p] for p in paths], promote_options="permissive")
         except Exception as e:
-            print(f"Failed to load {k}: {e}")
-    if not dfs:
+            log(f"Incompatible parquet schemas for {cust_id}: {e}")
+            return pd.DataFrame()
+        dataset = ds.dataset(paths, schema=schema, format="parquet", filesystem=arrow_s3)
+        columns = _projected_columns(schema.names, TXN_COLS)
+        # scan file by file, only the needed column chunks, so one bad file doesn't drop the customer
+        tables = [t for t in ex.map(partial(_try_scan_fragment, schema=schema, columns=columns),
+                                    dataset.get_fragments()) if t is not None]
+    if not tables:
         return pd.DataFrame()
-    df = pd.concat(dfs, ignore_index=True)
+    # every fragment was read against the same schema, so this only appends chunks
+    table = pa.concat_tables(tables)
+    # pd.to_numeric can't handle ArrowDtype decimals with nulls, so numeric amount/balance
+    # columns are cast to float64 in Arrow; only string-typed ones go through to_numeric
+    for i, field in enumerate(table.schema):
+        if field.name.lower() in (COLS["amt"], COLS["bal"]) and (
+                pa.types.is_decimal(field.type) or pa.types.is_integer(field.type)
+                or pa.types.is_floating(field.type)):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), pa.float64()))
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
     # normalize column names
     df.columns = [c.lower() for c in df.columns]
     # ensure date col exists and parsed
     if COLS["date"] in df.columns:
         df[COLS["date"]] = pd.to_datetime(df[COLS["date"]])
+    # strings stay Arrow-backed; amounts become plain float64 once, on the combined frame,
+    # so the numpy reductions and number formatting downstream see a single dtype
+    for col in (COLS["amt"], COLS["bal"]):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64").fillna(0)
     return df
 
-def password_for_customer(row, cust_id):
-    """Default password: last4(phone) else last4(cust_id)"""
-    phone_col = COLS["phone"]
-    phone = ""
-    if phone_col in row and pd.notnull(row[phone_col]):
-        phone = str(row[phone_col]).strip()
-    if phone and len(phone) >= 4:
-        return phone[-4:]
-    return str(cust_id)[-4:]
+def passwords_for_customers(meta_df):
+    """Default password per cust_id: last4(phone) else last4(cust_id)"""
+    phones = meta_df[COLS["phone"]].astype("string").str.strip().fillna("")
+    cust_ids = meta_df.index.to_series().astype("string")
+    return phones.where(phones.str.len() >= 4, cust_ids).str[-4:].to_dict()
 
 def format_currency(x):
     try:
@@ -123,14 +250,27 @@ def format_currency(x):
         return str(x)
 
 # -------- PDF layout helpers --------
-def _header_footer(canvas, doc, logo_img=None):
+def fit_to_width(text, width, font_size, font_name=BODY_FONT):
+    """Longest prefix of text that renders within width points"""
+    if pdfmetrics.stringWidth(text, font_name, font_size) <= width:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if pdfmetrics.stringWidth(text[:mid], font_name, font_size) <= width:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+def _header_footer(canvas, doc, logo_reader=None):
     canvas.saveState()
     # Header: logo left + bank name
     x_margin = 40
     y_top = PAGE_HEIGHT - 40
-    if logo_img:
+    if logo_reader:
         try:
-            canvas.drawImage(logo_img, x_margin, y_top - 40, width=80, height=30, mask='auto')
+            canvas.drawImage(logo_reader, x_margin, y_top - 40, width=80, height=30, mask='auto')
             canvas.setFont("Helvetica-Bold", 14)
             canvas.drawString(x_margin + 90, y_top - 10, "Your Bank Name")
         except Exception:
@@ -141,46 +281,45 @@ def _header_footer(canvas, doc, logo_img=None):
         canvas.drawString(x_margin, y_top - 10, "Your Bank Name")
 
     # Footer
-    canvas.setFont("Helvetica", 8)
+    canvas.setFont(BODY_FONT, 8)
     canvas.drawString(x_margin, 30, "This is a system generated statement. For queries contact support@yourdomain.com")
     canvas.restoreState()
 
-def build_statement_pdf_bytes(cust_meta, df_txns, logo_local_path=None):
+def build_statement_pdf_bytes(cust_meta, df_txns, password, logo_reader=None):
     """
-    Returns bytes of the generated PDF (unencrypted).
+    Returns bytes of the generated PDF, encrypted with password as it is written.
     cust_meta: dict {cust_id, name, email, phone, acct, period}
-    df_txns: DataFrame sorted by date for the period
+    df_txns: DataFrame from assemble_customer_df (amount/balance already float64)
     """
     buffer = io.BytesIO()
+    encrypt = StandardEncryption(userPassword=password, ownerPassword=password, canPrint=1, strength=128)
     doc = SimpleDocTemplate(buffer, pagesize=PAGE_SIZE,
                             leftMargin=36, rightMargin=36,
-                            topMargin=72, bottomMargin=72)
+                            topMargin=72, bottomMargin=72,
+                            encrypt=encrypt)
 
     # Page template to add header/footer
     def on_page(canvas, doc):
-        _header_footer(canvas, doc, logo_local_path)
+        _header_footer(canvas, doc, logo_reader)
 
     story = []
     story.append(Paragraph("<b>Monthly Bank Statement</b>", styles["Title"]))
     story.append(Spacer(1, 6))
     # meta
-    meta_html = (
-        f"<b>Account Holder:</b> {cust_meta.get('name','')}<br/>"
-        f"<b>Account No:</b> {cust_meta.get('acct','')}<br/>"
-        f"<b>Statement Period:</b> {cust_meta.get('period','')}<br/>"
-    )
+    meta_html = META_TEMPLATE.format(name=cust_meta.get('name',''), acct=cust_meta.get('acct',''),
+                                     period=cust_meta.get('period',''))
     story.append(Paragraph(meta_html, styles["Normal"]))
     story.append(Spacer(1, 12))
 
+    # sort once up front so the closing balance and the table rows agree on date order
+    df_txns = df_txns.sort_values(COLS["date"], kind="mergesort").reset_index(drop=True)
+
     # summary calculations
-    df_txns = df_txns.copy()
+    total_credits = total_debits = 0
     if COLS["amt"] in df_txns.columns:
-        df_txns[COLS["amt"]] = pd.to_numeric(df_txns[COLS["amt"]], errors="coerce").fillna(0)
-    if COLS["bal"] in df_txns.columns:
-        df_txns[COLS["bal"]] = pd.to_numeric(df_txns[COLS["bal"]], errors="coerce").fillna(0)
-
-    total_credits = df_txns[df_txns[COLS["amt"]] >= 0][COLS["amt"]].sum() if COLS["amt"] in df_txns.columns else 0
-    total_debits = df_txns[df_txns[COLS["amt"]] < 0][COLS["amt"]].sum() if COLS["amt"] in df_txns.columns else 0
+        amt_arr = df_txns[COLS["amt"]].to_numpy()
+        total_credits = np.maximum(amt_arr, 0).sum()
+        total_debits = np.minimum(amt_arr, 0).sum()
     closing_balance = df_txns.iloc[-1][COLS["bal"]] if len(df_txns) and COLS["bal"] in df_txns.columns else 0
 
     summary_table = [
@@ -189,33 +328,32 @@ def build_statement_pdf_bytes(cust_meta, df_txns, logo_local_path=None):
         ["Closing Balance", format_currency(closing_balance)],
     ]
     t = Table(summary_table, hAlign='LEFT', colWidths=[2.5*inch, 2.0*inch])
-    t.setStyle(TableStyle([('FONTSIZE', (0,0), (-1,-1), 9),
-                            ('BOTTOMPADDING', (0,0), (-1,-1), 6)]))
+    t.setStyle(SUMMARY_TABLE_STYLE)
     story.append(t)
     story.append(Spacer(1, 12))
 
     # Transaction Table header and rows
     cols_to_show = [COLS["date"], COLS["desc"], COLS["amt"], COLS["bal"]]
     header = ["Date", "Description", "Amount", "Balance"]
-    table_data = [header]
-
-    for _, r in df_txns.sort_values(COLS["date"]).iterrows():
-        date = pd.to_datetime(r[COLS["date"]]).strftime("%Y-%m-%d") if pd.notnull(r[COLS["date"]]) else ""
-        desc = str(r.get(COLS["desc"], ""))[:120]  # truncate long desc
-        amt = format_currency(r.get(COLS["amt"], ""))
-        bal = format_currency(r.get(COLS["bal"], ""))
-        table_data.append([date, desc, amt, bal])
-
+    dates = df_txns[COLS["date"]].dt.strftime("%Y-%m-%d").fillna("").to_numpy()
+    # missing optional columns render as blank cells rather than failing the statement
+    blank = pd.Series("", index=df_txns.index)
     # set col widths (adjust as needed)
     col_widths = [1.1*inch, 3.3*inch, 1.0*inch, 1.0*inch]
-    tx_table = Table(table_data, repeatRows=1, colWidths=col_widths)
-    tx_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f1f1f1')),
-        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('ALIGN', (2,1), (3,-1), 'RIGHT'),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-    ]))
+    # cells are single-line strings, so clip descriptions to the measured width of their
+    # column (minus the 6pt left/right cell padding) instead of letting them overrun Amount
+    desc_width = col_widths[1] - 12
+    descs = (df_txns[COLS["desc"]].astype("string").fillna("").astype(str) if COLS["desc"] in df_txns.columns else blank)
+    # rows are a fixed 14pt, so flatten line breaks before measuring
+    descs = descs.str.replace(r"[\r\n]+", " ", regex=True).str.slice(0, 120)
+    descs = descs.map(partial(fit_to_width, width=desc_width, font_size=8)).to_numpy()
+    amts = (df_txns[COLS["amt"]].map("{:,.2f}".format) if COLS["amt"] in df_txns.columns else blank).to_numpy()
+    bals = (df_txns[COLS["bal"]].map("{:,.2f}".format) if COLS["bal"] in df_txns.columns else blank).to_numpy()
+    table_data = [header] + list(map(list, zip(dates, descs, amts, bals)))
+
+    # LongTable + fixed row heights: splits per page and skips per-cell wrap measurement
+    tx_table = LongTable(table_data, repeatRows=1, colWidths=col_widths, rowHeights=[14]*len(table_data))
+    tx_table.setStyle(TX_TABLE_STYLE)
 
     story.append(tx_table)
     story.append(Spacer(1, 12))
@@ -227,25 +365,19 @@ def build_statement_pdf_bytes(cust_meta, df_txns, logo_local_path=None):
     buffer.seek(0)
     return buffer.read()
 
-def encrypt_pdf_bytes(pdf_bytes, password):
-    r = PdfReader(io.BytesIO(pdf_bytes))
-    w = PdfWriter()
-    for p in r.pages:
-        w.add_page(p)
-    w.encrypt(password)
-    out_buf = io.BytesIO()
-    w.write(out_buf)
-    out_buf.seek(0)
-    return out_buf.read()
-
 def upload_bytes_to_s3(bytes_obj, s3_key, content_type="application/pdf"):
-    s3.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=bytes_obj, ContentType=content_type)
+    if len(bytes_obj) < UPLOAD_MULTIPART_THRESHOLD:
+        # upload_fileobj would spin up a transfer manager and thread pool just for one part
+        s3.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=bytes_obj, ContentType=content_type)
+    else:
+        s3.upload_fileobj(io.BytesIO(bytes_obj), S3_BUCKET, s3_key,
+                          ExtraArgs={"ContentType": content_type}, Config=UPLOAD_TRANSFER_CFG)
     s3_url = f"s3://{S3_BUCKET}/{s3_key}"
     return s3_url
 
 def send_pdf_via_ses(to_email, subject, body_text, pdf_bytes, filename="statement.pdf"):
     if not ses:
-        print("SES not configured")
+        log("SES not configured")
         return None
     msg = MIMEMultipart()
     msg["Subject"] = subject
@@ -255,18 +387,110 @@ def send_pdf_via_ses(to_email, subject, body_text, pdf_bytes, filename="statemen
     part = MIMEApplication(pdf_bytes)
     part.add_header("Content-Disposition", "attachment", filename=filename)
     msg.attach(part)
-    resp = ses.send_raw_email(RawMessage={"Data": msg.as_string()})
+    # flatten straight to bytes; as_string() would build a str only for boto3 to re-encode it
+    buf = io.BytesIO()
+    BytesGenerator(buf, mangle_from_=False).flatten(msg)
+    resp = ses.send_raw_email(RawMessage={"Data": buf.getvalue()})
     return resp
 
 # def send_sms_via_sns(phone_number, message):
 #     if not sns:
-#         print("SNS not configured")
+#         log("SNS not configured")
 #         return None
 #     # phone_number must be in E.164 format like +919876543210
 #     resp = sns.publish(PhoneNumber=phone_number, Message=message)
 #     return resp
 
+def _ses_sender(send_q):
+    """Drain (to_email, subject, body, pdf_bytes, filename) items until a None sentinel"""
+    while True:
+        item = send_q.get()
+        try:
+            if item is None:
+                return
+            to_email, subject, body, pdf_bytes, filename = item
+            try:
+                resp = send_pdf_via_ses(to_email, subject, body, pdf_bytes, filename=filename)
+                log("Email sent via SES:", resp)
+            except Exception as e:
+                log("SES send failed:", e)
+        finally:
+            send_q.task_done()
+
+def start_ses_senders():
+    """Spawn SES sender threads sized to the account send rate; returns (send_q, threads)
+    Requires ses:GetSendQuota in addition to ses:SendRawEmail; if the lookup fails the
+    pool falls back to SES_MAX_SENDERS and adaptive retries absorb any throttling."""
+    try:
+        max_rate = int(ses.get_send_quota()["MaxSendRate"])
+    except Exception as e:
+        log(f"SES quota lookup failed, using {SES_MAX_SENDERS} senders:", e)
+        max_rate = SES_MAX_SENDERS
+    # bounded so PDF workers block instead of piling up attachments in memory
+    send_q = queue.Queue(maxsize=64)
+    threads = [threading.Thread(target=_ses_sender, args=(send_q,), daemon=True)
+               for _ in range(max(1, min(max_rate, SES_MAX_SENDERS)))]
+    for t in threads:
+        t.start()
+    return send_q, threads
+
+def stop_ses_senders(send_q, threads):
+    """Wait for queued sends to finish, then shut the sender threads down"""
+    send_q.join()
+    for _ in threads:
+        send_q.put(None)
+    for t in threads:
+        t.join()
+
 # -------- main pipeline --------
+def _process_one_customer(cust_id, keys, first, pwd, month_str, logo_reader, send_q):
+    log(f"Processing {cust_id} ...")
+    cust_meta = {
+        "cust_id": cust_id,
+        "name": first.get(COLS["name"], ""),
+        "email": first.get(COLS["email"], ""),
+        "phone": first.get(COLS["phone"], ""),
+        "acct": first.get(COLS["acct"], ""),
+        "period": month_str
+    }
+
+    # nothing to deliver -> don't pay for the full parquet load
+    email_addr = cust_meta.get("email")
+    can_email = SEND_VIA_SES and email_addr and "@" in str(email_addr)
+    if not can_email and not UPLOAD_TO_S3:
+        log(f"Skipping {cust_id} (no email and S3 upload disabled).")
+        return
+
+    df = assemble_customer_df(cust_id, keys)
+    if df.empty:
+        log(f"No transactions for {cust_id}, skipping.")
+        return
+
+    # build encrypted pdf bytes
+    try:
+        enc_bytes = build_statement_pdf_bytes(cust_meta, df, pwd, logo_reader=logo_reader)
+    except Exception as e:
+        log(f"Failed to build PDF for {cust_id}: {e}")
+        return
+
+    # upload encrypted pdf to S3 (optional)
+    s3_key = f"{OUTPUT_S3_PREFIX}/month={month_str}/{cust_id}_statement_{month_str}.pdf"
+    if UPLOAD_TO_S3:
+        try:
+            upload_bytes_to_s3(enc_bytes, s3_key)
+            log(f"Uploaded protected PDF to s3://{S3_BUCKET}/{s3_key}")
+        except Exception as e:
+            log("Upload failed:", e)
+
+    # send via SES
+    if can_email:
+        subject = EMAIL_SUBJECT_TEMPLATE.format(period=month_str)
+        body = EMAIL_BODY_TEMPLATE.format(name=cust_meta.get('name','Customer'))
+        # handed off to the SES sender threads; blocks while the queue is full
+        send_q.put((email_addr, subject, body, enc_bytes, f"{cust_id}_statement_{month_str}.pdf"))
+    else:
+        log(f"Skipping email for {cust_id} (no email or SES disabled).")
+
 def process_month(month_str):
     """
     month_str: e.g. "2025-11"
@@ -278,71 +502,40 @@ def process_month(month_str):
             logo_local = "/tmp/logo.png"
             s3.download_file(S3_BUCKET, LOGO_S3_KEY, logo_local)
         except Exception as e:
-            print("Logo download failed:", e)
+            log("Logo download failed:", e)
             logo_local = None
-
-    customers = list_customer_folders(month_str)
-    print("Found customers:", customers)
-
-    for cust_id in customers:
-        print(f"Processing {cust_id} ...")
-        df = assemble_customer_df(month_str, cust_id)
-        if df.empty:
-            print(f"No transactions for {cust_id}, skipping.")
-            continue
-
-        # try extract meta from first row
-        first = df.iloc[0] if len(df) else {}
-        cust_meta = {
-            "cust_id": cust_id,
-            "name": first.get(COLS["name"], "") if hasattr(first, 'get') else "",
-            "email": first.get(COLS["email"], "") if hasattr(first, 'get') else "",
-            "phone": first.get(COLS["phone"], "") if hasattr(first, 'get') else "",
-            "acct": first.get(COLS["acct"], "") if hasattr(first, 'get') else "",
-            "period": month_str
-        }
-
-        # build pdf bytes
+    # decode the logo once; the reader is shared by every page of every PDF
+    logo_reader = None
+    if logo_local:
         try:
-            pdf_bytes = build_statement_pdf_bytes(cust_meta, df, logo_local_path=logo_local)
+            logo_reader = ImageReader(logo_local)
+            # ImageReader decodes lazily without a lock; force it here, before the
+            # PDF threads share the reader, so concurrent drawImage calls don't race
+            logo_reader.getRGBData()
         except Exception as e:
-            print(f"Failed to build PDF for {cust_id}: {e}")
-            continue
+            log("Logo load failed:", e)
 
-        # determine password
-        pwd = password_for_customer(first if hasattr(first, 'get') else {}, cust_id)
+    customer_keys = dict(_customer_key_map(month_str))
+    log("Found customers:", list(customer_keys))
 
-        # encrypt
-        enc_bytes = encrypt_pdf_bytes(pdf_bytes, pwd)
+    # meta comes from the first row of each customer's first file; no need to assemble
+    # everything for it, and passwords for the whole month are derived in one pass
+    meta_df = load_month_meta(customer_keys)
+    passwords = passwords_for_customers(meta_df)
+    metas = meta_df.to_dict("index")
 
-        # upload encrypted pdf to S3 (optional)
-        s3_key = f"{OUTPUT_S3_PREFIX}/month={month_str}/{cust_id}_statement_{month_str}.pdf"
-        if UPLOAD_TO_S3:
-            try:
-                upload_bytes_to_s3(enc_bytes, s3_key)
-                print(f"Uploaded protected PDF to s3://{S3_BUCKET}/{s3_key}")
-            except Exception as e:
-                print("Upload failed:", e)
-
-        # send via SES
-        email_addr = cust_meta.get("email")
-        if SEND_VIA_SES and email_addr and "@" in str(email_addr):
-            subject = f"Your Monthly Bank Statement - {month_str}"
-            body = (
-                f"Dear {cust_meta.get('name','Customer')},\n\n"
-                "Please find attached your password-protected monthly bank statement.\n"
-                "For security, the password has been sent separately.\n\n"
-                "Regards,\nYour Bank"
-            )
-            try:
-                resp = send_pdf_via_ses(email_addr, subject, body, enc_bytes, filename=f"{cust_id}_statement_{month_str}.pdf")
-                print("Email sent via SES:", resp)
-            except Exception as e:
-                print("SES send failed:", e)
-        else:
-            print(f"Skipping email for {cust_id} (no email or SES disabled).")
-
-    print("Done processing month", month_str)
+    send_q, senders = start_ses_senders() if SEND_VIA_SES else (None, [])
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            list(ex.map(partial(_process_one_customer, month_str=month_str,
+                                logo_reader=logo_reader, send_q=send_q),
+                        metas.keys(), [customer_keys[c] for c in metas],
+                        metas.values(), [passwords[c] for c in metas]))
+    finally:
+        if send_q is not None:
+            stop_ses_senders(send_q, senders)
+
+    log("Done processing month", month_str)
 
 # -------- run example --------
 if __name__ == "__main__":